@@ -0,0 +1,81 @@
+""" Fast wire encoding for TimeBox messages (escape, checksum, framing).
+
+The escape-and-checksum routine runs once per frame during scrolls and
+animations, so it is the hottest byte loop in the package. When numba is
+installed the loop is JIT-compiled to native code operating on a uint8
+array with a head index; otherwise a bytearray-based pure-Python version
+is used, which still avoids per-byte list building.
+"""
+
+try:
+    import numba
+    import numpy as np
+except ImportError:
+    numba = None
+
+
+def _escape_and_checksum_py(payload):
+    """Frame a payload: leading 0x01, escaped payload and checksum,
+    trailing 0x02. Returns a bytearray."""
+    out = bytearray()
+    out.append(0x01)
+    csum = 0
+    for bval in payload:
+        csum += bval
+        if 0x01 <= bval <= 0x03:
+            out.append(0x03)
+            out.append(bval + 0x03)
+        else:
+            out.append(bval)
+    for cval in (csum & 0xff, (csum >> 8) & 0xff):
+        if 0x01 <= cval <= 0x03:
+            out.append(0x03)
+            out.append(cval + 0x03)
+        else:
+            out.append(cval)
+    out.append(0x02)
+    return out
+
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def _escape_and_checksum_njit(payload):
+        n = payload.shape[0]
+        # worst case every byte plus both checksum bytes are escaped
+        out = np.empty(2 * n + 8, dtype=np.uint8)
+        head = 0
+        out[head] = 0x01
+        head += 1
+        csum = 0
+        for i in range(n):
+            bval = payload[i]
+            csum += bval
+            if 0x01 <= bval <= 0x03:
+                out[head] = 0x03
+                out[head + 1] = bval + 0x03
+                head += 2
+            else:
+                out[head] = bval
+                head += 1
+        for cval in (csum & 0xff, (csum >> 8) & 0xff):
+            if 0x01 <= cval <= 0x03:
+                out[head] = 0x03
+                out[head + 1] = cval + 0x03
+                head += 2
+            else:
+                out[head] = cval
+                head += 1
+        out[head] = 0x02
+        head += 1
+        return out[:head]
+
+    def escape_and_checksum(payload):
+        """Frame a payload natively. Accepts any byte sequence and
+        returns a uint8 ndarray (bytes() gives the raw message)."""
+        if not isinstance(payload, (bytes, bytearray)):
+            payload = bytes(payload)
+        return _escape_and_checksum_njit(np.frombuffer(payload, dtype=np.uint8))
+
+else:
+    escape_and_checksum = _escape_and_checksum_py
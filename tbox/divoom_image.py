@@ -6,6 +6,7 @@ from PIL import ImageFont
 import math
 import os
 import sys
+import numpy as np
 from .timeboximage import TimeBoxImage
 
 """
@@ -96,6 +97,17 @@ class DivoomImage:
 		'''Create 10x10 images from a bigger image e.g. 10x40.'''
 		return self._slices(image=image, way=1, slice_size=slice_size)
 
+	def sliding_frames(self, image, slice_size=11):
+	    '''All horizontal scroll windows of an image as one zero-copy
+	    numpy view. Returns an (N, height, slice_size, 3) uint8 array
+	    with the same frame count as horizontal_slices, without
+	    allocating a cropped image per window.'''
+	    arr = np.asarray(image.convert('RGB'))
+	    nframes = max(arr.shape[1] - slice_size, 0)
+	    win = np.lib.stride_tricks.sliding_window_view(arr, slice_size, axis=1)
+	    # sliding_window_view yields (height, N, 3, slice_size)
+	    return win.transpose(1, 0, 3, 2)[:nframes]
+
 	def image_horizontal_slices(self, image_path, slice_size=11):
 		'''Create 10x10 images from a bigger image given as path.'''
 		img = Image.open(image_path)
@@ -158,6 +170,20 @@ class DivoomImage:
 	    return tb_img
 
 
+	def build_img_batch(self, frames):
+	    '''Nibble-pack a whole animation in one go. frames is an
+	    (N, 11, 11, 3) array-like of channel values 0-15; returns an
+	    (N, 182) uint8 array of packed pixel data, one row per frame,
+	    in the wire order of dynamic_image_payload.'''
+	    arr = np.asarray(frames, dtype=np.uint8)
+	    if arr.size == 0:
+	        return np.zeros((0, 0), dtype=np.uint8)
+	    vals = arr.reshape(arr.shape[0], -1)
+	    if vals.shape[1] & 1:
+	        vals = np.concatenate(
+	            [vals, np.zeros((vals.shape[0], 1), dtype=np.uint8)], axis=1)
+	    return vals[:, 0::2] | (vals[:, 1::2] << 4)
+
 	def load_image(self, file, sz=(11,11)):
 	    with Image.open(file).convert("RGBA") as imagedata:
 	        return self.build_img(imagedata,sz)
@@ -1,5 +1,7 @@
 """ Provides Message class to construct messages for the TimeBox """
 
+from ._encode import escape_and_checksum
+
 class TimeBoxMessages:
     """Support the formation of messages to communicatie with the TimeBox."""
 
@@ -51,15 +53,15 @@ class TimeBoxMessages:
         return unesc[:-2]
 
     def _extend_with_checksum(self, payload):
-        """Extend the payload with two byte with its checksum."""
-        return payload + self.checksum(payload)
+        """Extend the payload with two byte with its checksum.
+        Accepts any sequence of byte values (list, bytes, bytearray)."""
+        return list(payload) + self.checksum(payload)
 
     def make_message(self, payload):
         """Make a complete message from the paload data. Add leading 0x01 and
-        trailing check sum and 0x02 and escape the payload"""
-        cs_payload = self._extend_with_checksum(payload)
-        escaped_payload = self.escape_payload(cs_payload)
-        return [0x01] + escaped_payload + [0x02]
+        trailing check sum and 0x02 and escape the payload. Returns a byte
+        sequence (bytes() yields the wire message)."""
+        return escape_and_checksum(payload)
 
     def static_image_payload(self, imag):
         """Create the message payload for the image."""
@@ -109,3 +111,16 @@ class TimeBoxMessages:
     def dynamic_image_message(self, image, frame_num, frame_delay):
         """Creates a static image message from a TimeBoxImage."""
         return self.make_message(self.dynamic_image_payload(image, frame_num, frame_delay))
+
+    def static_image_message_packed(self, packed):
+        """Creates a static image message from pre-packed pixel nibbles
+        (one row of DivoomImage.build_img_batch)."""
+        header = bytes((0xbd, 0x00, 0x44, 0x00, 0x0a, 0x0a, 0x04))
+        return self.make_message(header + bytes(packed))
+
+    def dynamic_image_message_packed(self, packed, frame_num, frame_delay):
+        """Creates an animation frame message from pre-packed pixel nibbles
+        (one row of DivoomImage.build_img_batch)."""
+        header = bytes((0xbf, 0x00, 0x49, 0x00, 0x0a, 0x0a, 0x04,
+                        frame_num, frame_delay))
+        return self.make_message(header + bytes(packed))
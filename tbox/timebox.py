@@ -1,6 +1,8 @@
 """Provides class TimeBox that encapsulates the TimeBox communication."""
 
-import select
+import selectors
+import struct
+import numpy as np
 from bluetooth import BluetoothSocket, RFCOMM
 import bluetooth
 from .messages import TimeBoxMessages
@@ -11,6 +13,20 @@ import os
 from PIL import ImageColor
 from PIL import ImageFont
 
+# pre-bound little-endian uint16 packer for the payload length field
+_PACK_LENGTH = struct.Struct('<H').pack
+
+def _validate_pairs(texts):
+    """Check that texts is a non-empty iterable of (text, color) tuples
+    and return it as a list."""
+    try:
+        texts = list(texts)
+    except TypeError:
+        raise Exception("a list of tuple is expected")
+    if len(texts) == 0 or not isinstance(texts[0], tuple):
+        raise Exception("a list of tuple is expected")
+    return texts
+
 class TimeBox:
     """Class TimeBox encapsulates the TimeBox communication."""
 
@@ -31,16 +47,25 @@ class TimeBox:
         "set radio frequency": 0x61
     }
 
+    # command headers pre-encoded as single bytes, so the hot send path
+    # avoids rebuilding them per call
+    _CMD_BYTES = {k: bytes([v]) for k, v in COMMANDS.items()}
+
     socket = None
     messages = None
-    message_buf = []
     currentHost = None
 
+    # compact the message buffer once this many consumed bytes pile up
+    COMPACT_THRESHOLD = 4096
+
     def __init__(self, logger, host):
         self.messages = TimeBoxMessages()
         self.divoomImage = DivoomImage()
         self.logger = logger
         self.host = host
+        self.message_buf = bytearray()
+        self._read_head = 0
+        self._sel = None
 
     def connect(self, host=None, port=4):
         """Open a connection to the TimeBox."""
@@ -54,29 +79,34 @@ class TimeBox:
         #print("connecting to %s at %s" % (self.host, self.port))
         self.socket = BluetoothSocket(RFCOMM)
         self.socket.connect((self.currentHost, port))
-        self.socket.setblocking(0)
+        # the socket stays blocking so send/sendall never truncate a frame
+        # mid-write; reads are gated on the selector instead
+        if self._sel is not None:
+            self._sel.close()
+        self._sel = selectors.DefaultSelector()
+        self._sel.register(self.socket, selectors.EVENT_READ)
         #except Exception as error:
         #    self.logger.exception('Error while connecting to timebox')
 
     def close(self):
         """Closes the connection to the TimeBox."""
+        if self._sel is not None:
+            self._sel.close()
+            self._sel = None
         self.socket.close()
 
     def receive(self, num_bytes=1024):
         """Receive n bytes of data from the TimeBox and put it in the input buffer.
         Returns the number of bytes received."""
-        ready = select.select([self.socket], [], [], 0.1)
-        if ready[0]:
-            data = self.socket.recv(num_bytes)
-            self.message_buf += data
-            return len(data)
-        else:
+        if not self._sel.select(timeout=0):
             return 0
+        data = self.socket.recv(num_bytes)
+        self.message_buf.extend(data)
+        return len(data)
 
     def send_raw(self, data):
-        """Send raw data to the TimeBox."""
+        """Send raw, already framed data to the TimeBox."""
         while (1):
-            msg = self.messages.make_message(payload)
             try:
                 return self.socket.send(data)
             except Exception as error:
@@ -102,69 +132,74 @@ class TimeBox:
     def set_time(self, time=None):
       if not time:
         time=datetime.datetime.now()
-      args = []
-      args.append(int(str(time.year)[2:]))
-      args.append(int(str(time.year)[0:2]))
-      args.append(int(time.month))
-      args.append(int(time.day))
-      args.append(int(time.hour))
-      args.append(int(time.minute))
-      args.append(int(time.second))
-      args.append(0)
+      yh, yl = divmod(time.year, 100)
+      args = bytes((yl, yh, time.month, time.day,
+                    time.hour, time.minute, time.second, 0))
       self.send_command("set date time", args)
 
     def send_command(self, command, args=None):
         """Send command with optional arguments"""
-        if args is None:
-            args = []
         if isinstance(command, str):
-            command = self.COMMANDS[command]
-        length = len(args)+3
-        length_lsb = length & 0xff
-        length_msb = length >> 8
-        payload = [length_lsb, length_msb, command] + args
+            cmd = self._CMD_BYTES[command]
+        else:
+            cmd = bytes([command])
+        if args is None:
+            args = b''
+        elif not isinstance(args, (bytes, bytearray)):
+            args = bytes(args)
+        payload = _PACK_LENGTH(len(args)+3) + cmd + args
         self.send_payload(payload)
 
     def decode(self, msg):
         """remove leading 1, trailing 2 and checksum and un-escape"""
         return self.messages.decode(msg)
 
+    def _compact_message_buf(self):
+        """Discard consumed bytes once the dead prefix grows large enough to
+        be worth the copy."""
+        if self._read_head > self.COMPACT_THRESHOLD:
+            del self.message_buf[:self._read_head]
+            self._read_head = 0
+
     def has_message(self):
         """Check if there is a complete message *or leading garbage data* in the input buffer."""
-        if len(self.message_buf) == 0:
+        if self._read_head >= len(self.message_buf):
             return False
-        if self.message_buf[0] != 0x01:
+        if self.message_buf[self._read_head] != 0x01:
             return True
-        #endmarks = [x for x in self.message_buf if x == 0x02]
-        #return  len(endmarks) > 0
-        return 0x02 in self.message_buf
+        return self.message_buf.find(0x02, self._read_head) >= 0
 
     def buffer_starts_with_garbage(self):
         """Check if the input buffer starts with data other than a message."""
-        if len(self.message_buf) == 0:
+        if self._read_head >= len(self.message_buf):
             return False
-        return self.message_buf[0] != 0x01
+        return self.message_buf[self._read_head] != 0x01
 
     def remove_garbage(self):
         """Remove data from the input buffer that is not the start of a message."""
-        pos = self.message_buf.index(0x01) if 0x01 in self.message_buf else len(self.message_buf)
-        res = self.message_buf[0:pos]
-        self.message_buf = self.message_buf[pos:]
+        pos = self.message_buf.find(0x01, self._read_head)
+        if pos < 0:
+            pos = len(self.message_buf)
+        res = self.message_buf[self._read_head:pos]
+        self._read_head = pos
+        self._compact_message_buf()
         return res
 
     def remove_message(self):
         """Remove a message from the input buffer and return it. Assumes it has been checked that
         there is a complete message without leading garbage data"""
-        if not 0x02 in self.message_buf:
+        pos = self.message_buf.find(0x02, self._read_head)
+        if pos < 0:
             raise Exception('There is no message')
-        pos = self.message_buf.index(0x02) + 1
-        res = self.message_buf[0:pos]
-        self.message_buf = self.message_buf[pos:]
+        res = self.message_buf[self._read_head:pos+1]
+        self._read_head = pos + 1
+        self._compact_message_buf()
         return res
 
     def drop_message_buffer(self):
         """Drop all dat currently in the message buffer,"""
-        self.message_buf = []
+        self.message_buf = bytearray()
+        self._read_head = 0
 
     def set_static_image(self, image):
         """Set the image on the TimeBox"""
@@ -172,22 +207,32 @@ class TimeBox:
         self.socket.send(bytes(msg))
 
     def set_dynamic_images(self, images, frame_delay=1):
-        """Set the image on the TimeBox"""
-        fnum = 0
-        for img in images:
-            msg = self.messages.dynamic_image_message(img, fnum, frame_delay)
-            fnum = fnum + 1
-            self.socket.send(bytes(msg))
+        """Set the image on the TimeBox. images may be a list of
+        TimeBoxImage, a list of raw 11x11x3 pixel lists, or an
+        (N, 11, 11, 3) numpy array. All frames are nibble-packed in one
+        numpy pass and the messages are written with a single sendall."""
+        if not isinstance(images, np.ndarray):
+            images = np.asarray(
+                [img.image if hasattr(img, 'image') else img for img in images],
+                dtype=np.uint8)
+        packed = self.divoomImage.build_img_batch(images)
+        if len(packed) == 0:
+            return
+        buf = b''.join(bytes(self.messages.dynamic_image_message_packed(row, fnum, frame_delay))
+                       for fnum, row in enumerate(packed))
+        self.socket.sendall(buf)
 
     def show_temperature(self, color=None):
-        """Show temperature on the TimeBox in Celsius"""
+        """Show temperature on the TimeBox in Celsius.
+        color may be a list of ints or a bytes object."""
         args = [0x01, 0x00]
         if not color is None:
             args += color
         self.send_command("set view", args)
 
     def show_clock(self, color=None):
-        """Show clock on the TimeBox in the color"""
+        """Show clock on the TimeBox in the color.
+        color may be a list of ints or a bytes object."""
         args = [0x00, 0x01]
         if not color is None:
             args += color
@@ -202,8 +247,7 @@ class TimeBox:
         """
           Display text, call is blocking
         """
-        if (type(texts) is not list) or (len(texts)==0) or (type(texts[0]) is not tuple):
-            raise Exception("a list of tuple is expected")
+        texts = _validate_pairs(texts)
         img_result = self.divoomImage.create_default_image((0,0))
         for txt, color in texts:
             img_result = self.divoomImage.draw_text_to_image(txt, color, empty_start=False, empty_end=False, font=font)
@@ -213,30 +257,35 @@ class TimeBox:
         """
           Display text & scroll, call is blocking
         """
-        if (type(txt) is not list) or (len(txt)==0) or (type(txt[0]) is not tuple):
-            raise Exception("a list of tuple is expected")
+        txt = _validate_pairs(txt)
         im = self.divoomImage.draw_multiple_to_image(txt, font)
-        slices = self.divoomImage.horizontal_slices(im)
-        for i, s in enumerate(slices):
-            #s.save("./debug/%s.bmp"%i)
-            self.set_static_image(self.divoomImage.build_img(s))
-            time.sleep(1.0/speed)
+        # one strided view over all scroll windows, scaled to 0-15, then
+        # nibble-packed in a single batch; no per-frame image crops.
+        # frames are pre-encoded so the display loop only does I/O and the
+        # frame clock is not eaten by rendering
+        frames = self.divoomImage.sliding_frames(im) >> 4
+        packed = self.divoomImage.build_img_batch(frames)
+        msgs = [bytes(self.messages.static_image_message_packed(row))
+                for row in packed]
+        frame_time = 1.0/speed
+        deadline = time.monotonic()
+        for msg in msgs:
+            self.socket.send(msg)
+            deadline += frame_time
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
 
     def show_text2(self, txt, font=None):
         """
         Use dynamic_image_message to display scolling text
         Cannot go faster than 1fps
         """
-        if (type(txt) is not list) or (len(txt)==0) or (type(txt[0]) is not tuple):
-            raise Exception("a list of tuple is expected")
-        imgs = []
+        txt = _validate_pairs(txt)
         im = self.divoomImage.draw_multiple_to_image(txt, font)
-        slices = self.divoomImage.horizontal_slices(im)
-        for i, s in enumerate(slices):
-            # s.save("./debug/%s.bmp"%i)
-            imgs.append(self.divoomImage.build_img(s))
-        print (len(imgs))
-        self.set_dynamic_images(imgs)
+        frames = self.divoomImage.sliding_frames(im) >> 4
+        self.logger.debug("show_text2 frames=%d", len(frames))
+        self.set_dynamic_images(frames)
 
     def show_static_image(self, path):
       self.set_static_image(self.divoomImage.load_image(path))
@@ -251,5 +300,7 @@ class TimeBox:
 
     def clear_input_buffer_quick(self):
         """Quickly read most input from TimeBox and remove from buffer. """
-        while self.receive(512) == 512:
-            self.drop_message_buffer()
+        while self._sel.select(timeout=0):
+            if not self.socket.recv(4096):
+                break
+        self.drop_message_buffer()
@@ -5,11 +5,18 @@ Connects to a Divoom TimeBox over bluetooth.
 
 Simone Notargiacomo <notargiacomo.s@gmail.com>
 """
-import json, os
+import asyncio
+import os
 import time
 import logging
+from functools import lru_cache
 import voluptuous as vol
 
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
 import homeassistant.helpers.config_validation as cv
 from homeassistant.components.notify import (
     ATTR_DATA, PLATFORM_SCHEMA, BaseNotificationService)
@@ -17,6 +24,8 @@ from homeassistant.const import CONF_MAC
 
 REQUIREMENTS = ['PyBluez==0.22',
                 'colour==0.1.5',
+                'numpy',
+                'orjson',
                 'pillow',
                 'webcolors']
 
@@ -44,6 +53,15 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Required(CONF_FONT_DIR): cv.string
 })
 
+@lru_cache(maxsize=16)
+def _load_font(path, size=None):
+    """Load a PIL font, caching it so repeated notifications do not
+    re-open and re-parse the font file."""
+    from PIL import ImageFont
+    if path.endswith(".ttf"):
+        return ImageFont.truetype(path, size)
+    return ImageFont.load(path)
+
 def get_service(hass, config, discovery_info=None):
     """Get the TimeBox notification service."""
     image_dir = hass.config.path(config[CONF_IMAGE_DIR])
@@ -64,9 +82,14 @@ class TimeBoxNotificationService(BaseNotificationService):
             _LOGGER.error("image_dir {0} does not exist, timebox will not work".format(image_dir))
         if not os.path.isdir(font_dir):
             _LOGGER.error("font_dir {0} does not exist, timebox will not work".format(font_dir))
+        self._json_index = self._scan_image_dir()
 
         self._timebox = TimeBox(_LOGGER, host=mac)
         self._timebox.connect()
+        # the "red clock" view sent after every non-persistent notification;
+        # framed once here so the tail of send_message is a raw send
+        self._reset_msg = bytes(self._timebox.messages.make_message(
+            [0x08, 0x00, 0x45, 0x00, 0x01, 255, 0, 0]))
         # self._timebox.set_time()
         # color = [120, 0, 0]
         # self._timebox.show_clock(color=color)
@@ -114,66 +137,76 @@ class TimeBoxNotificationService(BaseNotificationService):
     def valid_image(self, image):
         """Verifies an image array is valid.
         An image should consist of a 2D array, 11x11. Each array
-        element is again an arry, containing a valid colour
-        (see valid_color())."""
-        valid = False
-        if (isinstance(image, list) and len(image) == 11):
-            valid = True
-            for row in image:
-                if (isinstance(row, list) and len(row) == 11):
-                    for pixel in row:
-                        if not self.valid_color(pixel):
-                            valid = False
-                            break
-                else:
-                    valid = False
-                    break
+        element is again an array of three channels, range 0-15.
+        Validated with two C-level numpy reductions instead of a
+        Python loop per pixel."""
+        import numpy as np
+        try:
+            arr = np.asarray(image, dtype=np.int16)
+        except (TypeError, ValueError, OverflowError):
+            arr = None
+        valid = (arr is not None and arr.shape == (11, 11, 3)
+                 and arr.min() >= 0 and arr.max() <= 15)
         if not valid:
             _LOGGER.error("Invalid image data received")
         return valid
 
+    def _scan_image_dir(self):
+        """Index the .json image files in image_dir with a single scandir,
+        so lookups per notification avoid a path build and open attempt."""
+        try:
+            return {e.name[:-5]: e.path
+                    for e in os.scandir(self._image_dir)
+                    if e.name.endswith('.json')}
+        except OSError:
+            return {}
+
     def load_image_file(self, image_file_name):
         """Loads image data from a file and returns it."""
-        fn = os.path.join(self._image_dir,
-                          "{0}.json".format(image_file_name))
+        fn = self._json_index.get(image_file_name)
+        if fn is None:
+            # the file may have been added after startup; rescan once
+            self._json_index = self._scan_image_dir()
+            fn = self._json_index.get(image_file_name)
+        if fn is None:
+            _LOGGER.error("No image file named {0}.json in {1}".format(
+                image_file_name, self._image_dir))
+            return None
         try:
-            fh = open(fn)
-        except:
+            with open(fn, 'rb') as fh:
+                buf = fh.read()
+        except OSError:
             _LOGGER.error("Unable to open {0}".format(fn))
             return None
         try:
-            image = json.load(fh)
+            image = _json.loads(buf)
             return image
         except Exception as e:
             _LOGGER.error("{0} does not contain a valid image in JSON format".format(fn))
             _LOGGER.error(e)
             return None
 
+    # lookup table scaling a 0-15 channel to 0-255
+    _C16 = bytes(range(0, 256, 16))
+
     def convert_color(self, color):
         """We expect all colors passed in to be in the range 0-15.
         But some parts of the timebox API expect 0-255. This function
         converts a passed in color array to something the API can
-        work with. Does not do validation itself."""
-        return [color[0]*16, color[1]*16, color[2]*16]
-
-    def send_message(self, message="", **kwargs):
-        if kwargs.get(ATTR_DATA) is None:
-            _LOGGER.error("Service call needs a message type")
-            return False
-
-        data = kwargs.get(ATTR_DATA)
-
-        fontfile = 'slkscr.pil'
-        from PIL import ImageFont
-        font = ImageFont.load(os.path.join(self._font_dir, fontfile))
-        if data.get(PARAM_FONT):
-            fontfile = data.get(PARAM_FONT)
-
-        if fontfile.endswith(".pil"):
-            font = ImageFont.load(os.path.join(self._font_dir, fontfile))
-        elif fontfile.endswith(".ttf"):
-            font = ImageFont.truetype(os.path.join(self._font_dir, fontfile), 11)
-
+        work with. Does not do validation itself. Returns bytes so the
+        command path can concatenate it without an intermediate list."""
+        return bytes((self._C16[color[0]], self._C16[color[1]], self._C16[color[2]]))
+
+    def _resolve_font(self, data):
+        """Resolve and load the font for a text mode. Only called from the
+        branches that actually draw text, so clock/temp/image notifications
+        never touch the font file."""
+        fontfile = data.get(PARAM_FONT) or 'slkscr.pil'
+        return _load_font(os.path.join(self._font_dir, fontfile), 11)
+
+    def _display(self, data):
+        """Dispatch on mode and drive the TimeBox. Blocking; runs in an
+        executor thread."""
         if data.get(PARAM_MODE) == "off":
             self._timebox.disable_display()
             # self._timebox.set_static_image(self._blank_image)
@@ -210,6 +243,7 @@ class TimeBoxNotificationService(BaseNotificationService):
                 self.display_image_file(image_filename)
 
         elif data.get(PARAM_MODE) == 'text':
+            font = self._resolve_font(data)
             text = []
             for txt, color in data['text']:
                 text.append((txt, color))
@@ -219,12 +253,14 @@ class TimeBoxNotificationService(BaseNotificationService):
                 self._timebox.show_text(text, font=font)
 
         elif data.get(PARAM_MODE) == 'text2':
+            font = self._resolve_font(data)
             text = []
             for txt, color in data['text']:
                 text.append((txt, color))
             self._timebox.show_text2(text, font=font)
 
         elif data.get(PARAM_MODE) == 'str':
+            font = self._resolve_font(data)
             text = []
             for txt, color in data['text']:
                 text.append((txt, color))
@@ -245,9 +281,38 @@ class TimeBoxNotificationService(BaseNotificationService):
             _LOGGER.error("Invalid mode '{0}', must be one of 'off', 'clock', 'temp', 'image', 'animation'".format(data.get(PARAM_MODE)))
             return False
 
+        return True
+
+    def send_message(self, message="", **kwargs):
+        if kwargs.get(ATTR_DATA) is None:
+            _LOGGER.error("Service call needs a message type")
+            return False
+
+        data = kwargs.get(ATTR_DATA)
+        if not self._display(data):
+            return False
+
         if data.get(PARAM_TYPE) != "persist":
             time.sleep(5)
-            color = [255, 0, 0]
-            self._timebox.show_clock(color=color)
+            self._timebox.send_raw(self._reset_msg)
+
+        return True
+
+    async def async_send_message(self, message="", **kwargs):
+        """Async entry point: run the BT I/O in the executor and sleep on
+        the event loop, so no executor thread is pinned for the 5 second
+        reset delay."""
+        if kwargs.get(ATTR_DATA) is None:
+            _LOGGER.error("Service call needs a message type")
+            return False
+
+        data = kwargs.get(ATTR_DATA)
+        if not await self.hass.async_add_executor_job(self._display, data):
+            return False
+
+        if data.get(PARAM_TYPE) != "persist":
+            await asyncio.sleep(5)
+            await self.hass.async_add_executor_job(
+                self._timebox.send_raw, self._reset_msg)
 
         return True